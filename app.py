@@ -1,8 +1,10 @@
+import hashlib
+from enum import IntEnum
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import numpy as np
-from babel.numbers import format_currency 
+import plotly.graph_objects as go
+import pyarrow as pa
+from babel import Locale
 
 # ===================================================================================
 # 1. CONFIGURAÇÃO DA PÁGINA E VARIÁVEIS GLOBAIS
@@ -19,9 +21,34 @@ CURRENCY_LOCALE = 'pt_BR'
 CURRENCY_SYMBOL = 'R$'
 CURRENCY_CODE = 'BRL'
 
+# Locale e padrão de moeda do Babel resolvidos uma única vez (o format_currency refaria essa busca a cada chamada)
+_LOCALE_MOEDA = Locale.parse(CURRENCY_LOCALE)
+_PADRAO_MOEDA = _LOCALE_MOEDA.currency_formats['standard']
+
+# Tabela de tradução para trocar ',' <-> '.' em uma única passada (formato numérico brasileiro: 1.234,56)
+_BR_SWAP = str.maketrans({',': '.', '.': ','})
+
+# Tabelas de limpeza dos números lidos como texto (aplicadas com str.translate, sem passar pelo motor de regex)
+_LIMPEZA_VOLUME = str.maketrans({',': '.'})
+_LIMPEZA_VALOR = str.maketrans({'R': None, '$': None, ',': '.'})
+
 # Definir cores
 COR_AZUL_VOLUME = '#29C5F6'
 COR_VERDE_VALOR = '#6AD44D'
+COR_MAPA = {'Volume_M3': COR_AZUL_VOLUME, 'Valor': COR_VERDE_VALOR} # Cor de cada variável nos gráficos
+
+# Layout comum aos gráficos (fundo transparente, títulos em branco e legenda horizontal no topo).
+# Definido uma única vez e reaproveitado com fig.update_layout(**LAYOUT_COMUM, ...).
+LAYOUT_COMUM = dict(
+    height=500,
+    barmode='relative',
+    plot_bgcolor='rgba(0, 0, 0, 0)',
+    paper_bgcolor='rgba(0, 0, 0, 0)',
+    title_font_color='white',
+    legend_title_font_color='white',
+    separators=',.', # Números do eixo no padrão brasileiro (vírgula decimal, ponto de milhar), como nos KPIs e no hover
+    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+)
 
 # Dicionário de tradução para os dias da semana (para evitar erro de locale no Streamlit Cloud)
 TRADUCAO_DIAS = {
@@ -33,7 +60,9 @@ TRADUCAO_DIAS = {
     'Saturday': 'Sábado',
     'Sunday': 'Domingo'
 }
-ORDEM_DIAS = list(TRADUCAO_DIAS.values()) # Usada para ordenação de gráficos
+ORDEM_DIAS = list(TRADUCAO_DIAS.values()) # Usada para ordenação de gráficos (índice = dt.weekday)
+TIPO_DIA_SEMANA = pd.CategoricalDtype(ORDEM_DIAS, ordered=True) # Tipo categórico ordenado da coluna 'Dia da Semana'
+MAX_LEITURAS_EM_CACHE = 4 # Quantas leituras de planilha (e resultados derivados de cada uma) os caches guardam
 
 # Colunas esperadas e suas alternativas prováveis (Normalizadas para busca)
 # ATUALIZADO V6: Inclui os nomes exatos 'Rótulos de Linha', 'Qtd.M³' e 'Custo'
@@ -50,31 +79,117 @@ COLUNAS_ESPERADAS_E_MAPEAMENTO_FIXO = {
 # 2. FUNÇÕES DE PROCESSAMENTO
 # ===================================================================================
 
-# Cache para evitar recarregar o arquivo Excel toda vez
-@st.cache_data
-def carregar_e_processar_dados(uploaded_file, header_row, sheet_name):
+# Tabela de tradução usada na normalização: remove espaços/pontos, '³' -> '3' e tira o acento de Ê/Á
+_TABELA_NORMALIZACAO = str.maketrans({' ': None, '.': None, '³': '3', 'Ê': 'E', 'Á': 'A'})
+
+
+def normalizar_nome_coluna(nome):
+    """Normaliza um nome de coluna para a busca (maiúsculas, sem espaços/pontos, '³' -> '3', sem acento em Ê/Á)."""
+    return str(nome).upper().translate(_TABELA_NORMALIZACAO)
+
+
+# Alternativas já normalizadas de cada coluna esperada (calculadas uma única vez, na importação)
+_ALTERNATIVAS_POR_COLUNA = {
+    coluna_padrao: [normalizar_nome_coluna(alt) for alt in alternativas]
+    for coluna_padrao, alternativas in COLUNAS_ESPERADAS_E_MAPEAMENTO_FIXO.items()
+}
+
+# Todos os nomes (normalizados) que podem corresponder a alguma coluna esperada
+_ALTERNATIVAS_NORMALIZADAS = {
+    alt_norm
+    for alternativas in _ALTERNATIVAS_POR_COLUNA.values()
+    for alt_norm in alternativas
+}
+
+
+def abrir_planilha(arquivo):
+    """
+    Abre o arquivo Excel com o motor 'calamine' (leitor em Rust, várias vezes mais rápido que o openpyxl).
+    Se o python-calamine não estiver instalado (ou o pandas for anterior à 2.2), ou se o calamine
+    não conseguir abrir um arquivo mais exótico, usa o openpyxl.
+    O parâmetro arquivo é o próprio arquivo enviado (UploadedFile, um BytesIO): o leitor recebe o buffer
+    que já está em memória, sem uma cópia intermediária dos bytes do .xlsx.
+    """
+    try:
+        arquivo.seek(0)
+        return pd.ExcelFile(arquivo, engine='calamine')
+    except Exception:
+        # O leitor openpyxl do pandas já abre a pasta de trabalho com read_only=True e data_only=True:
+        # as linhas são lidas em fluxo (sem montar a árvore completa de células) e as fórmulas
+        # vêm com o último valor calculado salvo no arquivo.
+        # (volta ao início do arquivo, caso a tentativa com o calamine já tenha lido parte dele)
+        arquivo.seek(0)
+        return pd.ExcelFile(arquivo, engine='openpyxl')
+
+
+def chave_do_arquivo(uploaded_file):
+    """
+    Retorna um hash (BLAKE2b) do conteúdo do arquivo enviado, usado como chave do cache de leitura.
+    O hash é calculado uma única vez por upload e guardado em st.session_state junto com o file_id,
+    então os reruns seguintes não percorrem de novo os bytes do arquivo.
+    """
+    file_id, chave = st.session_state.get('chave_arquivo', (None, None))
+    if file_id != uploaded_file.file_id:
+        chave = hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+        st.session_state['chave_arquivo'] = (uploaded_file.file_id, chave)
+    return chave
+
+
+class StatusCarga(IntEnum):
+    """Resultado da leitura do arquivo, devolvido por carregar_e_processar_dados junto com o DataFrame."""
+    OK = 0
+    SEM_ARQUIVO = 1
+    ABA_NAO_ENCONTRADA = 2
+    ERRO_LEITURA = 3
+    COLUNAS_FALTANTES = 4
+    SEM_DADOS_VALIDOS = 5
+
+
+# Cache para evitar recarregar o arquivo Excel toda vez.
+# A chave do cache é o hash do CONTEÚDO do arquivo (chave_arquivo) e não o próprio arquivo:
+# o parâmetro _arquivo começa com '_' e por isso o Streamlit não o inclui no hash. Assim qualquer
+# rerun com o mesmo arquivo (troca de filtro, clique em widget) não relê o Excel nem refaz o hash dos bytes.
+# O cache fica só em memória (sem persist="disk"): o cache em disco do Streamlit nunca apaga entradas,
+# e os dados de cada planilha enviada ficariam gravados no servidor para sempre.
+# max_entries limita quantos arquivos (ou combinações de aba/cabeçalho) ficam guardados, para a
+# memória não crescer a cada upload novo.
+@st.cache_data(show_spinner=False, max_entries=MAX_LEITURAS_EM_CACHE)
+def carregar_e_processar_dados(_arquivo, chave_arquivo, header_row, sheet_name):
     """
     Carrega o arquivo Excel, limpa e processa os dados brutos.
+    O parâmetro _arquivo é o arquivo enviado (UploadedFile); só é lido quando não há resultado em cache.
+    O parâmetro chave_arquivo é o hash do conteúdo do arquivo (ver chave_do_arquivo).
     O parâmetro header_row indica qual linha do Excel contém o cabeçalho (começa em 0).
     O parâmetro sheet_name indica o nome da aba a ser lida.
+    Retorna (df, status, colunas_lidas): status é um StatusCarga e colunas_lidas é o texto com os nomes
+    de colunas lidos na aba (usado no diagnóstico de colunas faltantes; vazio nos demais casos).
     """
-    if uploaded_file is not None:
+    if _arquivo is not None:
         try:
-            # Tenta ler o arquivo Excel, usando a linha de cabeçalho e o NOME da aba especificada
-            df_bruto = pd.read_excel(uploaded_file, header=header_row, sheet_name=sheet_name)
-        except ValueError as ve:
-             # Este erro geralmente ocorre se o nome da aba estiver errado
-            st.error(f"Erro: O nome da aba ('{sheet_name}') não foi encontrado no arquivo Excel. Verifique se digitou o nome corretamente (sensível a maiúsculas/minúsculas e espaços).")
-            return pd.DataFrame(), ["Erro de Nome de Aba"], []
+            # Abre o arquivo Excel UMA única vez: o .xlsx é descompactado e o XML é lido só aqui,
+            # e a mesma instância serve tanto para conferir as abas quanto para ler os dados.
+            with abrir_planilha(_arquivo) as planilha:
+                if sheet_name not in planilha.sheet_names:
+                    # O nome da aba está errado (sensível a maiúsculas/minúsculas e espaços)
+                    st.error(f"Erro: O nome da aba ('{sheet_name}') não foi encontrado no arquivo Excel. Verifique se digitou o nome corretamente (sensível a maiúsculas/minúsculas e espaços).")
+                    return pd.DataFrame(), StatusCarga.ABA_NAO_ENCONTRADA, ""
+
+                # Lista de nomes de colunas originais do arquivo (para diagnóstico)
+                colunas_originais = []
+
+                def coluna_necessaria(nome):
+                    # Chamado pelo pandas para cada nome do cabeçalho: guarda o nome para o diagnóstico
+                    # e só deixa passar as colunas que podem ser Data/Volume_M3/Valor.
+                    colunas_originais.append(nome)
+                    return normalizar_nome_coluna(nome) in _ALTERNATIVAS_NORMALIZADAS
+
+                # Lê a aba especificada, usando a linha de cabeçalho informada. Com usecols, as demais
+                # colunas da planilha (ex: outras colunas de uma tabela dinâmica) nem chegam a virar DataFrame.
+                # O DataFrame lido é local a esta função, então é processado direto, sem .copy().
+                df = planilha.parse(sheet_name, header=header_row, usecols=coluna_necessaria)
         except Exception as e:
             st.error(f"Erro ao ler o arquivo Excel. Detalhe: {e}")
-            return pd.DataFrame(), ["Erro de Leitura"], []
-
-        
-        df = df_bruto.copy()
-        
-        # Lista de nomes de colunas originais do arquivo (para diagnóstico)
-        colunas_originais = list(df.columns)
+            return pd.DataFrame(), StatusCarga.ERRO_LEITURA, ""
 
         colunas_faltantes = []
         colunas_mapeadas = {}
@@ -82,17 +197,15 @@ def carregar_e_processar_dados(uploaded_file, header_row, sheet_name):
         # 1. Normaliza as colunas do DataFrame para facilitar a busca (uppercase, sem espaços/pontos/acento)
         colunas_df_normalizadas = {
             # Cria a chave normalizada (ex: 'MEDIADEVALOR2') -> valor (nome da coluna original 'Média de VALOR2')
-            str(col).upper().replace(' ', '').replace('.', '').replace('³', '3').replace('Ê', 'E').replace('Á', 'A'): col 
+            normalizar_nome_coluna(col): col
             for col in df.columns
         }
         
         # 2. Tenta mapear as colunas usando os nomes fixos do arquivo do usuário
-        for coluna_padrao, alternativas in COLUNAS_ESPERADAS_E_MAPEAMENTO_FIXO.items():
+        # (as alternativas já vêm normalizadas de _ALTERNATIVAS_POR_COLUNA)
+        for coluna_padrao, alternativas in _ALTERNATIVAS_POR_COLUNA.items():
             encontrado = False
-            for alt in alternativas:
-                # Normaliza a alternativa para busca
-                alt_norm = alt.upper().replace(' ', '').replace('.', '').replace('³', '3').replace('Ê', 'E').replace('Á', 'A')
-                
+            for alt_norm in alternativas:
                 if alt_norm in colunas_df_normalizadas:
                     # Encontrou uma coluna: Adiciona ao mapeamento e renomeia
                     nome_original = colunas_df_normalizadas[alt_norm]
@@ -105,141 +218,304 @@ def carregar_e_processar_dados(uploaded_file, header_row, sheet_name):
 
 
         # Se alguma coluna essencial estiver faltando, retorna erro
+        # (com os nomes lidos já juntos num texto, guardado em cache com o resultado)
         if colunas_faltantes:
-            return pd.DataFrame(), colunas_faltantes, colunas_originais
+            return pd.DataFrame(), StatusCarga.COLUNAS_FALTANTES, ', '.join(str(c) for c in colunas_originais)
         
         # Executa o renomeamento após verificar todas as colunas
         df.rename(columns=colunas_mapeadas, inplace=True)
 
         # 3. Limpeza de dados
-        # Converte 'Data' para o formato datetime, ignorando erros
-        df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+        # Converte 'Data' para o formato datetime, ignorando erros.
+        # Se o leitor do Excel já entregou a coluna tipada como data, não há nada a converter.
+        if not pd.api.types.is_datetime64_any_dtype(df['Data']):
+            # Primeiro com o formato brasileiro fixo (dd/mm/aaaa), que usa o parser vetorizado do pandas
+            # (e também aceita células que o Excel já entregou como data).
+            # Cada tentativa é convertida para a mesma resolução ('us'): conforme a entrada, o pandas devolve
+            # datetime64[s] ou [ns], e a atribuição por máscara entre resoluções diferentes gera TypeError.
+            datas = pd.to_datetime(df['Data'], format='%d/%m/%Y', errors='coerce').dt.as_unit('us')
+            # Segunda tentativa com o formato ISO (aaaa-mm-dd, com ou sem hora), também vetorizado,
+            # e só por último a inferência de formato (lenta, linha a linha) no que ainda sobrar
+            pendentes = datas.isna() & df['Data'].notna()
+            if pendentes.any():
+                datas[pendentes] = pd.to_datetime(df.loc[pendentes, 'Data'], format='ISO8601', errors='coerce').dt.as_unit('us')
+                pendentes = datas.isna() & df['Data'].notna()
+            if pendentes.any():
+                datas[pendentes] = pd.to_datetime(df.loc[pendentes, 'Data'], errors='coerce').dt.as_unit('us')
+            df['Data'] = datas
         # Remove linhas onde a data é inválida (NaN). Isso garante que 'Rótulos de Linha' seja a data.
         df.dropna(subset=['Data'], inplace=True)
         
-        # Converte 'Volume_M3' e 'Valor' para números, ignorando erros
+        # Converte 'Volume_M3' e 'Valor' para números, ignorando erros.
+        # As colunas ficam em float64: em float32 as somas por dia/dia da semana perdem centavos
+        # (ex: R$ 230.628,75 em vez de ,76) e as tabelas de inspeção mostram ruído como 143.600006.
+        # A limpeza de texto só roda quando a coluna NÃO veio numérica do Excel (o caso comum é vir
+        # como número, e aí não há por que convertê-la para texto e de volta).
         # Tenta converter o Volume, substituindo a vírgula por ponto para garantir que seja um decimal
-        df['Volume_M3'] = df['Volume_M3'].astype(str).str.replace(',', '.', regex=False)
+        if not pd.api.types.is_numeric_dtype(df['Volume_M3']):
+            df['Volume_M3'] = df['Volume_M3'].astype(str).str.translate(_LIMPEZA_VOLUME)
         df['Volume_M3'] = pd.to_numeric(df['Volume_M3'], errors='coerce')
         
-        # Tenta converter o Valor, removendo 'R$' e substituindo a vírgula por ponto (se for o caso)
-        df['Valor'] = df['Valor'].astype(str).str.replace('R$', '', regex=False).str.replace(',', '.', regex=False)
+        # Tenta converter o Valor, removendo 'R$' e substituindo a vírgula por ponto (se for o caso), numa única passada
+        if not pd.api.types.is_numeric_dtype(df['Valor']):
+            df['Valor'] = df['Valor'].astype(str).str.translate(_LIMPEZA_VALOR)
         df['Valor'] = pd.to_numeric(df['Valor'], errors='coerce')
         
-        # Remove linhas onde Volume_M3 ou Valor são NaN ou zero (dados irrelevantes)
-        df.dropna(subset=['Volume_M3', 'Valor'], inplace=True)
-        df = df[(df['Volume_M3'] > 0) & (df['Valor'] > 0)]
+        # Remove linhas onde Volume_M3 ou Valor são NaN ou zero (dados irrelevantes) numa única máscara:
+        # comparações com NaN dão False, então "> 0" já descarta os NaN sem um dropna separado.
+        volume = df['Volume_M3'].to_numpy()
+        valor = df['Valor'].to_numpy()
+        df = df[(volume > 0) & (valor > 0)]
 
         # 4. Criação de Colunas Auxiliares
         
-        # Solução robusta para locale: GERA o nome do dia em INGLÊS e depois TRADUZ manualmente.
-        df['Dia da Semana'] = df['Data'].dt.day_name().map(TRADUCAO_DIAS)
+        # Solução robusta para locale: não depende do nome do dia gerado pelo sistema, usa os nomes de TRADUCAO_DIAS.
+        # Guardado como categoria ordenada (Segunda -> Domingo): agrupamentos e gráficos já saem na ordem certa.
+        # dt.weekday (0 = segunda ... 6 = domingo) já é o código da categoria em ORDEM_DIAS:
+        # monta o categórico direto dos códigos, sem gerar os nomes em inglês nem passar pelo .map.
+        df['Dia da Semana'] = pd.Categorical.from_codes(df['Data'].dt.weekday.to_numpy(), dtype=TIPO_DIA_SEMANA)
         
-        df['Mês/Ano'] = df['Data'].dt.to_period('M').astype(str)
+        # Mês/Ano como categoria: o rótulo em texto ('aaaa-mm') é gerado uma vez por mês (nas categorias),
+        # e não uma string Python por linha; cada linha guarda só o código inteiro do mês.
+        df['Mês/Ano'] = df['Data'].dt.to_period('M').astype('category').cat.rename_categories(str)
         df['Ano'] = df['Data'].dt.year
 
         # 5. Ordenação (necessária para os gráficos)
         df.sort_values(by='Data', inplace=True)
 
-        return df, [], []
+        if df.empty:
+            return df, StatusCarga.SEM_DADOS_VALIDOS, ""
+        return df, StatusCarga.OK, ""
     
-    return pd.DataFrame(), ["Arquivo não enviado"], []
+    return pd.DataFrame(), StatusCarga.SEM_ARQUIVO, ""
+
+
+# Agregações usadas pelos gráficos, calculadas uma única vez por arquivo: os gráficos recebem
+# só os totais (poucas linhas) e não varrem de novo o DataFrame completo a cada rerun.
+# O DataFrame entra como _df (fora do hash do cache): hashear o df inteiro custaria uma varredura
+# completa a cada rerun. A chave do cache é chave_dados, que identifica a leitura que gerou o df.
+@st.cache_data(show_spinner=False, max_entries=MAX_LEITURAS_EM_CACHE)
+def agregar_dados(_df, chave_dados):
+    """
+    Calcula os totais de Volume e Valor usados pelos gráficos e os KPIs:
+    - por dia (com a coluna Mês/Ano, usada no filtro do gráfico diário);
+    - por dia da semana (7 linhas, na ordem de ORDEM_DIAS);
+    - KPIs gerais (totais e médias de Volume e Valor), num dicionário.
+    O parâmetro chave_dados é a tupla (hash do arquivo, linha do cabeçalho, aba) usada na leitura.
+    """
+    df = _df
+    # as_index=False já devolve 'Data' como coluna (sem o reset_index, que copiava o resultado).
+    # O df chega ordenado por Data, então sort=False mantém a mesma ordem sem reordenar os grupos.
+    df_diario = df.groupby('Data', as_index=False, sort=False).agg(
+        {'Mês/Ano': 'first', 'Volume_M3': 'sum', 'Valor': 'sum'}
+    )
+
+    # Nota: Removi a linha 'Total Geral' do gráfico para evitar distorção visual na escala
+    # e mantive apenas a soma do Volume e Valor nos KPIs gerais.
+    # 'Dia da Semana' é categórica ordenada: com observed=False o groupby já devolve os 7 dias,
+    # na ordem de ORDEM_DIAS e com soma 0 nos dias sem dados (sem reindex/fillna).
+    df_dia_semana = df.groupby('Dia da Semana', as_index=False, observed=False).agg(
+        {'Volume_M3': 'sum', 'Valor': 'sum'}
+    )
+
+    # KPIs gerais
+    volumes = df['Volume_M3'].to_numpy()
+    valores = df['Valor'].to_numpy()
+    kpis = {
+        'total_volume': volumes.sum(),
+        'total_valor': valores.sum(),
+        'volume_medio_diario': volumes.mean(),
+        'valor_medio_diario': valores.mean(),
+    }
+
+    return df_diario, df_dia_semana, kpis
+
+
+# Estatísticas descritivas da tabela de inspeção, calculadas uma única vez por arquivo
+# (mesma chave de agregar_dados; describe() varre todas as colunas numéricas do df).
+@st.cache_data(show_spinner=False, max_entries=MAX_LEITURAS_EM_CACHE)
+def descrever_dados(_df, chave_dados):
+    """Retorna o describe() do DataFrame processado (contagem, média, desvio, quartis etc.)."""
+    return _df.describe()
+
+
+# Tabela completa já convertida para Arrow (formato que o st.dataframe envia ao navegador),
+# uma única vez por arquivo. cache_resource devolve a própria pa.Table (imutável), sem a cópia
+# via pickle do cache_data, e o st.dataframe não refaz a conversão pandas -> Arrow a cada rerun.
+@st.cache_resource(show_spinner=False, max_entries=MAX_LEITURAS_EM_CACHE)
+def tabela_arrow(_df, chave_dados):
+    """Converte o DataFrame processado em pyarrow.Table (sem o índice) para exibição."""
+    return pa.Table.from_pandas(_df, preserve_index=False)
+
+
+# CSV dos dados processados para o botão de download, gerado uma única vez por arquivo
+# (mesma chave de agregar_dados: o df entra como _df e não é hasheado a cada rerun).
+@st.cache_data(show_spinner=False, max_entries=MAX_LEITURAS_EM_CACHE)
+def gerar_csv(_df, chave_dados):
+    """
+    Converte o DataFrame processado em CSV no padrão brasileiro (separador ';' e vírgula decimal),
+    com BOM UTF-8 para o Excel abrir os acentos corretamente.
+    """
+    return _df.to_csv(index=False, sep=';', decimal=',', date_format='%d/%m/%Y').encode('utf-8-sig')
 
 # ===================================================================================
 # 3. FUNÇÕES DE VISUALIZAÇÃO (Sem alterações)
 # ===================================================================================
 
-def criar_grafico_dia_semana(df):
-    """Cria um gráfico de barras agrupadas de Volume e Valor por Dia da Semana."""
-    
-    global ORDEM_DIAS
-    
-    df_agrupado = df.groupby('Dia da Semana').agg(
-        {'Volume_M3': 'sum', 'Valor': 'sum'}
-    ).reindex(ORDEM_DIAS).reset_index().fillna(0)
+def formatar_moeda(valor):
+    """Formata um valor numérico como moeda brasileira (ex: R$ 1.234,56)."""
+    return _PADRAO_MOEDA.apply(valor, _LOCALE_MOEDA, currency=CURRENCY_CODE)
 
-    # Nota: Removi a linha 'Total Geral' do gráfico para evitar distorção visual na escala
-    # e mantive apenas a soma do Volume e Valor nos KPIs gerais.
 
-    df_agrupado['Valor formatado'] = df_agrupado['Valor'].apply(
-        lambda x: format_currency(x, CURRENCY_CODE, locale=CURRENCY_LOCALE)
-    )
+def formatar_volume(valor):
+    """Formata um volume no padrão brasileiro (ex: 1.234,56 m³) com um único str.translate."""
+    return f"{valor:,.2f} m³".translate(_BR_SWAP)
 
-    cor_mapa = {'Volume_M3': COR_AZUL_VOLUME, 'Valor': COR_VERDE_VALOR}
 
-    fig_dia_semana = px.bar(
-        df_agrupado,
-        x='Dia da Semana',
-        y=['Volume_M3', 'Valor'],
-        title='Volume (m³) e Valor (R$) por Dia da Semana',
-        color_discrete_map=cor_mapa,
-        height=500
-    )
+def formatar_moeda_serie(serie):
+    """
+    Formata uma Series inteira como moeda (usada nos textos de hover, uma linha por barra).
+    Monta o texto com f-string + str.translate numa list comprehension, sem passar pelo Babel a cada
+    linha; o resultado é o mesmo de formatar_moeda (ex: R$ 1.234,56). O Babel fica para os KPIs.
+    """
+    return [f"{CURRENCY_SYMBOL}\xa0{v:,.2f}".translate(_BR_SWAP) for v in serie.to_numpy()]
 
-    fig_dia_semana.update_traces(
-        # textposition='outside', # Removido para evitar sobreposição em barras menores
-        textfont=dict(size=14, color='white'), 
-        hovertemplate='Dia: %{x}<br>Volume: %{customdata[0]:,.2f} m³<br>Valor: %{customdata[1]}<extra></extra>',
-        customdata=np.stack((df_agrupado['Volume_M3'], df_agrupado['Valor formatado']), axis=-1)
-    )
+
+def formatar_volume_serie(serie):
+    """
+    Formata uma Series inteira como volume (textos de hover), no mesmo padrão de formatar_volume
+    (ex: 1.234,56 m³): o d3-format do Plotly (%{...:,.2f}) usaria o padrão americano (1,234.56).
+    """
+    return [f"{v:,.2f} m³".translate(_BR_SWAP) for v in serie.to_numpy()]
+
+
+# Os construtores de figura ficam em cache: num rerun com os mesmos dados (Streamlit faz o hash
+# do DataFrame), a figura Plotly já montada é reutilizada em vez de ser reconstruída.
+# cache_resource devolve o próprio objeto guardado: com cache_data a figura seria despicklada
+# (e revalidada pelo Plotly) a cada rerun. O st.plotly_chart só lê a figura (faz uma cópia
+# com to_dict), então compartilhar a mesma instância entre reruns e sessões é seguro.
+# Por ser global (todas as sessões), o cache é limitado com max_entries: um gráfico por dia da semana
+# para cada leitura guardada e, no diário, um por mês.
+@st.cache_resource(show_spinner=False, max_entries=MAX_LEITURAS_EM_CACHE)
+def construir_grafico_dia_semana(df_dia_semana):
+    """
+    Monta o gráfico de barras agrupadas de Volume e Valor por Dia da Semana.
+    Recebe os totais por dia da semana já calculados em agregar_dados.
+    """
+
+    df_agrupado = df_dia_semana.assign(**{
+        'Volume formatado': formatar_volume_serie(df_dia_semana['Volume_M3']),
+        'Valor formatado': formatar_moeda_serie(df_dia_semana['Valor'])
+    })
+
+    # Dados do hover, montados uma vez e compartilhados pelas duas traces
+    customdata = df_agrupado[['Volume formatado', 'Valor formatado']].to_numpy()
+
+    # Uma trace go.Bar por variável, direto das colunas do DataFrame agrupado (sem o melt
+    # para formato longo que o px.bar faz internamente com y=[...]). O hover já entra na
+    # construção da trace, sem um update_traces posterior.
+    # Rótulos de texto nas barras removidos (sobreposição em barras menores): nenhum texto
+    # por barra é gerado nem enviado ao navegador, só o hover.
+    fig_dia_semana = go.Figure()
+    for coluna in ['Volume_M3', 'Valor']:
+        fig_dia_semana.add_trace(go.Bar(
+            x=df_agrupado['Dia da Semana'],
+            y=df_agrupado[coluna],
+            name=coluna,
+            marker_color=COR_MAPA[coluna],
+            customdata=customdata,
+            hovertemplate='Dia: %{x}<br>Volume: %{customdata[0]}<br>Valor: %{customdata[1]}<extra></extra>'
+        ))
 
     fig_dia_semana.update_layout(
+        **LAYOUT_COMUM,
+        title_text='Volume (m³) e Valor (R$) por Dia da Semana',
         yaxis_title=None, 
         yaxis=dict(showgrid=False, showticklabels=True, title='Volume (m³) / Valor (R$)'), 
-        xaxis=dict(showgrid=False, showticklabels=True),
-        plot_bgcolor='rgba(0, 0, 0, 0)', 
-        paper_bgcolor='rgba(0, 0, 0, 0)', 
-        title_font_color='white',
-        legend_title_font_color='white',
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        xaxis=dict(showgrid=False, showticklabels=True, title='Dia da Semana')
     )
 
-    st.plotly_chart(fig_dia_semana, use_container_width=True)
+    return fig_dia_semana
 
 
-def criar_grafico_longo_diario(df):
-    """Cria um gráfico de barras com o histórico Volume vs Valor ao longo do tempo."""
+@st.cache_resource(show_spinner=False, max_entries=12 * MAX_LEITURAS_EM_CACHE)
+def construir_grafico_longo_diario(df_diario):
+    """
+    Monta o gráfico de barras com o histórico Volume vs Valor ao longo do tempo.
+    Recebe os totais por dia já calculados em agregar_dados (filtrados pelo mês selecionado).
+    """
 
-    df_long_diario = df.groupby('Data').agg(
-        {'Volume_M3': 'sum', 'Valor': 'sum'}
-    ).reset_index()
+    df_long_diario = df_diario.assign(**{
+        'Data formatada': df_diario['Data'].dt.strftime('%d/%m/%Y'),
+        'Volume formatado': formatar_volume_serie(df_diario['Volume_M3']),
+        'Valor formatado': formatar_moeda_serie(df_diario['Valor'])
+    })
+
+    customdata = df_long_diario[['Data formatada', 'Volume formatado', 'Valor formatado']].to_numpy()
+
+    # Mesmo esquema do gráfico por dia da semana: duas traces go.Bar, sem o pipeline do px.bar
+    fig_longo_agrupado = go.Figure()
+    for coluna in ['Volume_M3', 'Valor']:
+        fig_longo_agrupado.add_trace(go.Bar(
+            x=df_long_diario['Data'],
+            y=df_long_diario[coluna],
+            name=coluna,
+            marker_color=COR_MAPA[coluna],
+            customdata=customdata,
+            hovertemplate='Data: %{customdata[0]}<br>Volume: %{customdata[1]}<br>Valor: %{customdata[2]}<extra></extra>'
+        ))
 
-    df_long_diario['Data formatada'] = df_long_diario['Data'].dt.strftime('%d/%m/%Y')
-    
-    df_long_diario['Valor formatado'] = df_long_diario['Valor'].apply(
-        lambda x: format_currency(x, CURRENCY_CODE, locale=CURRENCY_LOCALE)
+    fig_longo_agrupado.update_layout(
+        **LAYOUT_COMUM,
+        title_text='Análise Diária de Volume (m³) e Valor Gasto (R$)',
+        yaxis_title=None, 
+        yaxis=dict(showgrid=False, showticklabels=True), 
+        # Datas no eixo em formato numérico (dd/mm): não depende do locale do servidor nem do navegador
+        xaxis=dict(showgrid=False, title='Data', tickformat='%d/%m')
     )
 
-    cor_mapa = {'Volume_M3': COR_AZUL_VOLUME, 'Valor': COR_VERDE_VALOR}
+    return fig_longo_agrupado
 
-    fig_longo_agrupado = px.bar(
-        df_long_diario,
-        x='Data',
-        y=['Volume_M3', 'Valor'],
-        title='Análise Diária de Volume (m³) e Valor Gasto (R$)',
-        color_discrete_map=cor_mapa,
-        height=500
-    )
 
-    fig_longo_agrupado.update_traces(
-        # textposition='outside', # Removido para evitar sobreposição em barras menores
-        textfont=dict(size=14, color='white'), 
-        hovertemplate='Data: %{customdata[0]}<br>Volume: %{customdata[1]:,.2f} m³<br>Valor: %{customdata[2]}<extra></extra>',
-        customdata=np.stack((df_long_diario['Data formatada'], df_long_diario['Volume_M3'], df_long_diario['Valor formatado']), axis=-1)
-    )
+def criar_grafico_dia_semana(df_dia_semana):
+    """Cria (ou reaproveita do cache) o gráfico de Volume e Valor por Dia da Semana."""
+    st.plotly_chart(construir_grafico_dia_semana(df_dia_semana), use_container_width=True)
 
-    fig_longo_agrupado.update_layout(
-        yaxis_title=None, 
-        yaxis=dict(showgrid=False, showticklabels=True), 
-        xaxis=dict(showgrid=False),
-        plot_bgcolor='rgba(0, 0, 0, 0)', 
-        paper_bgcolor='rgba(0, 0, 0, 0)',
-        title_font_color='white',
-        legend_title_font_color='white',
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+
+def criar_grafico_longo_diario(df_diario):
+    """Cria (ou reaproveita do cache) o gráfico com o histórico Volume vs Valor ao longo do tempo."""
+    st.plotly_chart(construir_grafico_longo_diario(df_diario), use_container_width=True)
+
+
+# Fragmento: ao trocar o mês, o Streamlit reexecuta só esta seção
+# (KPIs, gráfico por dia da semana e tabelas não são recalculados).
+@st.fragment
+def secao_analise_diaria(df_diario):
+    """
+    Seção do gráfico diário, com o seletor de Mês/Ano que filtra o gráfico.
+    Recebe os totais por dia (agregar_dados), então o filtro de mês roda sobre no máximo uma linha por dia.
+    """
+
+    # Mês/Ano único. O seletor fica junto do gráfico: widgets de um fragmento não podem ir para a barra lateral.
+    meses_disponiveis = df_diario['Mês/Ano'].unique()
+    mes_ano_selecionado = st.selectbox(
+        "Selecione o Mês/Ano para a Análise Diária:",
+        options=meses_disponiveis,
+        index=len(meses_disponiveis) - 1 # Padrão para o último mês
     )
 
-    st.plotly_chart(fig_longo_agrupado, use_container_width=True)
+    # Filtra o DataFrame. Os totais diários estão ordenados por Data, então o mês é um trecho contíguo:
+    # a busca binária (searchsorted) acha o início e o fim e o iloc devolve a fatia, sem máscara booleana.
+    periodo = pd.Period(mes_ano_selecionado, freq='M')
+    inicio = df_diario['Data'].searchsorted(periodo.start_time, side='left')
+    fim = df_diario['Data'].searchsorted(periodo.end_time, side='right')
+    df_filtrado_diario = df_diario.iloc[inicio:fim]
+
+    st.subheader(f"Comparativo Diário de Consumo no Mês: {mes_ano_selecionado}")
+    if not df_filtrado_diario.empty:
+        criar_grafico_longo_diario(df_filtrado_diario)
+    else:
+        st.warning("Dados insuficientes para o gráfico diário no mês selecionado.")
 
 # ===================================================================================
 # 4. LAYOUT DO DASHBOARD (Streamlit)
@@ -271,11 +547,10 @@ header_row_index = st.sidebar.number_input(
     help="Se a planilha tiver linhas de título ou espaços antes do cabeçalho real (Data, Volume, Valor), aumente este número. Ex: se o cabeçalho estiver na 3ª linha do Excel, use 3. (Ajuste interno: Linha digitada - 1)."
 )
 
-# Inicializa o DataFrame vazio e a lista de erros
+# Inicializa o DataFrame vazio e o status da leitura
 df_processado = pd.DataFrame()
-colunas_faltantes = ["Nenhum dado processado"]
-colunas_originais_lidas = []
-dados_carregados = False
+status_carga = StatusCarga.SEM_ARQUIVO
+colunas_lidas = ""
 
 # Processamento condicional após o upload do arquivo
 if uploaded_file is not None:
@@ -283,13 +558,11 @@ if uploaded_file is not None:
     pandas_header_index = header_row_index - 1 
 
     # Chama a função de processamento com o novo parâmetro sheet_name
-    df_processado, colunas_faltantes, colunas_originais_lidas = carregar_e_processar_dados(uploaded_file, pandas_header_index, sheet_name)
-    
-    # Verifica se o DataFrame tem dados e se não há colunas faltantes
-    if not df_processado.empty and not colunas_faltantes:
-        dados_carregados = True
-    else:
-        dados_carregados = False
+    # O hash do conteúdo do arquivo é a chave do cache: reruns com o mesmo arquivo não relêem o Excel.
+    chave_arquivo = chave_do_arquivo(uploaded_file)
+    df_processado, status_carga, colunas_lidas = carregar_e_processar_dados(
+        uploaded_file, chave_arquivo, pandas_header_index, sheet_name
+    )
 
 
 # --- Seção Principal ---
@@ -297,17 +570,17 @@ if uploaded_file is not None:
 if not uploaded_file:
     st.info("Aguardando o upload de um arquivo Excel para iniciar a análise.")
 
-elif not dados_carregados:
+elif status_carga != StatusCarga.OK:
     st.error(f"Erro ao carregar ou processar os dados. Verifique a estrutura do seu arquivo.")
     
-    # Mensagem específica para colunas faltantes
-    if "Erro de Nome de Aba" in colunas_faltantes:
+    # Mensagem específica para cada tipo de erro
+    if status_carga == StatusCarga.ABA_NAO_ENCONTRADA:
         st.warning(f"Por favor, verifique se o nome da aba '{sheet_name}' está correto.")
-    elif "Erro de Leitura" in colunas_faltantes:
+    elif status_carga == StatusCarga.ERRO_LEITURA:
         st.warning("Não foi possível ler o arquivo. Certifique-se de que é um arquivo Excel (.xlsx) válido e não está protegido por senha.")
-    elif colunas_faltantes and colunas_faltantes[0] != "Arquivo não enviado":
-        st.warning(f"O arquivo foi carregado, mas as colunas necessárias estão faltando ou não foram reconhecidas. Colunas esperadas: Data, Volume_M3, Valor. Nomes de colunas lidas na aba '{sheet_name}': {', '.join([str(c) for c in colunas_originais_lidas])}")
-    elif df_processado.empty and uploaded_file is not None:
+    elif status_carga == StatusCarga.COLUNAS_FALTANTES:
+        st.warning(f"O arquivo foi carregado, mas as colunas necessárias estão faltando ou não foram reconhecidas. Colunas esperadas: Data, Volume_M3, Valor. Nomes de colunas lidas na aba '{sheet_name}': {colunas_lidas}")
+    elif status_carga == StatusCarga.SEM_DADOS_VALIDOS:
         st.warning("O arquivo foi carregado, mas o DataFrame está vazio após o processamento (filtros de data/valor). Verifique se as colunas 'Data', 'Volume_M3' e 'Valor' (ou equivalentes) estão preenchidas corretamente e contêm valores maiores que zero.")
     
     # Se houver dados brutos (após erro), exibe a inspeção
@@ -316,36 +589,26 @@ elif not dados_carregados:
             st.dataframe(df_processado.head(20))
 
 else:
-    # --- FILTROS ---
-    st.sidebar.header("Passo 2: Filtros de Período")
-
-    # Mês/Ano único
-    meses_disponiveis = df_processado['Mês/Ano'].unique()
-    mes_ano_selecionado = st.sidebar.selectbox(
-        "Selecione o Mês/Ano para a Análise Diária:",
-        options=meses_disponiveis,
-        index=len(meses_disponiveis) - 1 # Padrão para o último mês
-    )
-    
-    # Filtra o DataFrame
-    df_filtrado_diario = df_processado[df_processado['Mês/Ano'] == mes_ano_selecionado]
+    # Totais por dia e por dia da semana e KPIs (calculados uma vez por arquivo, em cache)
+    chave_dados = (chave_arquivo, pandas_header_index, sheet_name)
+    df_diario, df_dia_semana, kpis = agregar_dados(df_processado, chave_dados)
 
     # --- MÉTRICAS (KPIs) ---
     col1, col2, col3, col4 = st.columns(4)
 
-    # Cálculo dos KPIs
-    total_volume = df_processado['Volume_M3'].sum()
-    total_valor = df_processado['Valor'].sum()
-    volume_medio_diario = df_processado['Volume_M3'].mean()
-    valor_medio_diario = df_processado['Valor'].mean()
+    # KPIs já calculados em agregar_dados
+    total_volume = kpis['total_volume']
+    total_valor = kpis['total_valor']
+    volume_medio_diario = kpis['volume_medio_diario']
+    valor_medio_diario = kpis['valor_medio_diario']
     
     # Formatação dos KPIs
-    valor_formatado_total = format_currency(total_valor, CURRENCY_CODE, locale=CURRENCY_LOCALE)
-    valor_formatado_medio = format_currency(valor_medio_diario, CURRENCY_CODE, locale=CURRENCY_LOCALE)
+    valor_formatado_total = formatar_moeda(total_valor)
+    valor_formatado_medio = formatar_moeda(valor_medio_diario)
     
-    col1.metric("Volume Total (m³)", f"{total_volume:,.2f} m³")
+    col1.metric("Volume Total (m³)", formatar_volume(total_volume))
     col2.metric("Custo Total (R$)", valor_formatado_total)
-    col3.metric("Volume Médio Diário (m³)", f"{volume_medio_diario:,.2f} m³")
+    col3.metric("Volume Médio Diário (m³)", formatar_volume(volume_medio_diario))
     col4.metric("Custo Médio Diário (R$)", valor_formatado_medio)
 
     st.markdown("---")
@@ -353,22 +616,27 @@ else:
     # --- GRÁFICOS ---
     
     # Gráfico 1: Análise Diária (Filtrada por Mês)
-    st.subheader(f"Comparativo Diário de Consumo no Mês: {mes_ano_selecionado}")
-    if not df_filtrado_diario.empty:
-        criar_grafico_longo_diario(df_filtrado_diario)
-    else:
-        st.warning("Dados insuficientes para o gráfico diário no mês selecionado.")
+    secao_analise_diaria(df_diario)
 
     st.markdown("---")
 
     # Gráfico 2: Análise por Dia da Semana (Total do Período)
     st.subheader("Volume e Valor por Dia da Semana (Total do Período)")
-    criar_grafico_dia_semana(df_processado)
+    criar_grafico_dia_semana(df_dia_semana)
 
     st.markdown("---")
 
     # Tabela de Inspeção Final
     with st.expander("Inspeção de Dados Processados (Para Validação)"):
         st.dataframe(df_processado.head())
-        st.dataframe(df_processado.describe())
-        st.dataframe(df_processado) # Tabela completa no final
+        st.dataframe(descrever_dados(df_processado, chave_dados))
+        # A tabela completa só é enviada ao navegador quando pedida: mesmo com o expander fechado,
+        # o st.dataframe serializaria o DataFrame inteiro a cada rerun.
+        if st.checkbox("Mostrar tabela completa"):
+            st.dataframe(tabela_arrow(df_processado, chave_dados), use_container_width=True)
+            st.download_button(
+                "Baixar dados processados (CSV)",
+                data=gerar_csv(df_processado, chave_dados),
+                file_name="dados_processados.csv",
+                mime="text/csv",
+            )